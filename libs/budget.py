@@ -0,0 +1,57 @@
+# encoding: utf-8
+from contextlib import contextmanager
+import threading
+
+
+class MemoryBudget(object):
+    """Process-wide byte budget shared by everything that holds chunks
+    in memory.
+
+    Callers `acquire` the number of bytes they are about to hold and
+    `release` them when done; `acquire` blocks while the budget is used up.
+    A request larger than the whole budget waits until the budget is
+    drained and is then granted alone, so it never deadlocks."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.current = 0
+        self.peak = 0
+
+        self._cond = threading.Condition(threading.Lock())
+
+
+    def acquire(self, size):
+        with self._cond:
+            while self.current and self.current + size > self.limit:
+                self._cond.wait()
+
+            self.current += size
+            if self.current > self.peak:
+                self.peak = self.current
+
+
+    def release(self, size):
+        with self._cond:
+            self.current -= size
+            assert self.current >= 0
+            self._cond.notify_all()
+
+
+    @contextmanager
+    def reserve(self, size):
+        self.acquire(size)
+        try:
+            yield
+        finally:
+            self.release(size)
+
+
+    def reset_peak(self):
+        with self._cond:
+            self.peak = self.current
+
+
+    def usage(self):
+        """Return a (current, peak, limit) snapshot in bytes."""
+        with self._cond:
+            return self.current, self.peak, self.limit
@@ -0,0 +1,233 @@
+# encoding: utf-8
+"""Throughput history of finished tasks, kept in a local SQLite store.
+
+usage:
+    python -m libs.history report [--db PATH] [--host HOST]
+                                  [--direction DIRECTION] [--days N]
+                                  [--period day|week]
+    python -m libs.history list [--db PATH] [--limit N]"""
+import argparse
+from collections import defaultdict
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+
+# override with the MAES_UI_HISTORY_DB environment variable
+DEFAULT_DB_PATH = os.environ.get('MAES_UI_HISTORY_DB',
+                                 os.path.join(os.path.expanduser('~'),
+                                              '.maes-ui', 'history.sqlite3'))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    direction TEXT NOT NULL,
+    key_length INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    wall_time REAL NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    host TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_host_timestamp ON tasks (host, timestamp);
+'''
+
+COLUMNS = ('timestamp', 'direction', 'key_length', 'bytes',
+           'wall_time', 'chunk_size', 'host')
+
+# upper bounds of the file size buckets, in bytes
+SIZE_BUCKETS = [(1024 * 1024, '< 1 MB'),
+                (16 * 1024 * 1024, '1-16 MB'),
+                (256 * 1024 * 1024, '16-256 MB'),
+                (4 * 1024 * 1024 * 1024, '256 MB-4 GB'),
+                (None, '>= 4 GB')]
+
+PERCENTILES = (10, 50, 90)
+
+PERIODS = {'day': '%Y-%m-%d',
+           'week': '%Y-W%W'}
+
+
+def size_bucket(size):
+    for bound, label in SIZE_BUCKETS:
+        if bound is None or size < bound:
+            return label
+
+
+def percentile(values, p):
+    """Linearly interpolated percentile of sorted `values`."""
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100.
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def to_mb_per_sec(speed):
+    return '%.2f' % (speed / (1024 * 1024))
+
+
+
+class ThroughputHistory(object):
+    """Records finished tasks and reports their throughput.
+    Connections are opened per call, so one instance can be shared by the
+    worker threads."""
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+
+
+    def connect(self):
+        dir_path = os.path.dirname(self.path)
+        if dir_path and not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.executescript(SCHEMA)
+        return conn
+
+
+    def record(self, direction, key_length, size, wall_time, chunk_size,
+               host=None, timestamp=None):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute(
+                    'INSERT INTO tasks (%s) VALUES (?, ?, ?, ?, ?, ?, ?)' %
+                    ', '.join(COLUMNS),
+                    (timestamp or time.time(), direction, key_length, size,
+                     wall_time, chunk_size, host or socket.gethostname())
+                )
+        finally:
+            conn.close()
+
+
+    def rows(self, host=None, direction=None, since=None, limit=None):
+        """Return matching tasks as dicts, newest first."""
+        where, args = [], []
+        if host:
+            where.append('host = ?')
+            args.append(host)
+        if direction:
+            where.append('direction = ?')
+            args.append(direction)
+        if since:
+            where.append('timestamp >= ?')
+            args.append(since)
+
+        query = 'SELECT %s FROM tasks' % ', '.join(COLUMNS)
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY timestamp DESC'
+        if limit:
+            query += ' LIMIT %d' % limit
+
+        conn = self.connect()
+        try:
+            return [dict(zip(COLUMNS, row))
+                    for row in conn.execute(query, args)]
+        finally:
+            conn.close()
+
+
+    def report(self, host=None, direction=None, since=None, period='day'):
+        """Throughput percentiles per host, per host and size bucket, and
+        per host and `period` to show trends, as lines of text."""
+        by_host = defaultdict(list)
+        by_bucket = defaultdict(list)
+        by_period = defaultdict(list)
+
+        for row in self.rows(host, direction, since):
+            if row['wall_time'] <= 0:
+                continue
+            speed = row['bytes'] / row['wall_time']
+            by_host[row['host']].append(speed)
+            by_bucket[row['host'], size_bucket(row['bytes'])].append(speed)
+            by_period[row['host'],
+                      time.strftime(PERIODS[period],
+                                    time.localtime(row['timestamp']))
+                      ].append(speed)
+
+        if not by_host:
+            return ['no tasks recorded']
+
+        def line(label, speeds):
+            speeds.sort()
+            return '  %-24s %6d  %s' % (
+                label, len(speeds),
+                '  '.join('%10s' % to_mb_per_sec(percentile(speeds, p))
+                          for p in PERCENTILES)
+            )
+
+        header = '  %-24s %6s  %s' % (
+            '', 'tasks',
+            '  '.join('%10s' % ('p%d' % p) for p in PERCENTILES)
+        )
+
+        lines = ['throughput per host (MB/s)', header]
+        for _host in sorted(by_host):
+            lines.append(line(_host, by_host[_host]))
+
+        lines += ['', 'throughput per host and file size (MB/s)', header]
+        bucket_order = [label for _, label in SIZE_BUCKETS]
+        for _host, bucket in sorted(by_bucket, key=lambda k: (
+                k[0], bucket_order.index(k[1]))):
+            lines.append(line('%s %s' % (_host, bucket),
+                              by_bucket[_host, bucket]))
+
+        lines += ['', 'trend per host and %s (MB/s)' % period, header]
+        for _host, _period in sorted(by_period):
+            lines.append(line('%s %s' % (_host, _period),
+                              by_period[_host, _period]))
+
+        return lines
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m libs.history',
+        description='Report throughput history of finished tasks.'
+    )
+    parser.add_argument('--db', default=DEFAULT_DB_PATH,
+                        help='history database (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command')
+
+    report = commands.add_parser('report',
+                                 help='percentiles and trends per host')
+    report.add_argument('--host', help='only tasks run on HOST')
+    report.add_argument('--direction', choices=('encryption', 'decryption'))
+    report.add_argument('--days', type=float,
+                        help='only tasks of the last DAYS days')
+    report.add_argument('--period', choices=sorted(PERIODS), default='day',
+                        help='trend granularity (default: %(default)s)')
+
+    listing = commands.add_parser('list', help='most recent tasks')
+    listing.add_argument('--limit', type=int, default=20)
+
+    args = parser.parse_args(argv)
+    history = ThroughputHistory(args.db)
+
+    if args.command == 'report':
+        since = time.time() - args.days * 86400 if args.days else None
+        lines = history.report(args.host, args.direction, since, args.period)
+    else:
+        lines = ['%s  %-10s %3d-bit %14d bytes %9.2f sec  %s MB/s  %s' % (
+                     time.strftime('%Y-%m-%d %H:%M:%S',
+                                   time.localtime(row['timestamp'])),
+                     row['direction'], row['key_length'], row['bytes'],
+                     row['wall_time'],
+                     to_mb_per_sec(row['bytes'] / row['wall_time'])
+                     if row['wall_time'] > 0 else 'inf',
+                     row['host'])
+                 for row in history.rows(limit=args.limit)]
+
+    for l in lines:
+        print(l)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
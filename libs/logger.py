@@ -1,5 +1,6 @@
 # encoding: utf-8
 from logging import Handler, Formatter, makeLogRecord
+import threading
 from PySide.QtCore import *
 
 
@@ -55,3 +56,71 @@ class ColoredFormatter(Formatter):
         return s
 
 
+
+class QueueHandler(Handler):
+    """Handler which only puts records into a queue, so that the threads
+    doing the logging never format records or touch Qt."""
+
+    def __init__(self, queue):
+        self.queue = queue
+        super(QueueHandler, self).__init__()
+
+
+    def prepare(self, record):
+        # merge args and exception into the record now, the listener
+        # thread may see the record after its args have been mutated
+        _r = makeLogRecord(record.__dict__)
+        _r.msg = record.getMessage()
+        _r.args = None
+        if record.exc_info:
+            _r.exc_text = Formatter().formatException(record.exc_info)
+            _r.exc_info = None
+        return _r
+
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+
+
+class QueueListener(object):
+    """Pulls records from a queue in a single thread and fans them out to
+    `handlers`."""
+
+    _sentinel = None
+
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None
+
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def _monitor(self):
+        while True:
+            record = self.queue.get()
+            if record is self._sentinel:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+    def stop(self):
+        if not self._thread:
+            return
+
+        self.queue.put(self._sentinel)
+        self._thread.join()
+        self._thread = None
+
+        for handler in self.handlers:
+            handler.flush()
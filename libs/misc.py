@@ -1,18 +1,57 @@
 # encoding: utf-8
 import hashlib
+import os
 import struct
 from PySide.QtGui import *
 from PySide.QtCore import *
 import sys
+from libs.budget import MemoryBudget
 
 
 CHUNK_SIZE = 8192 * 128
 CHUNK_SIZE_AND_A_BLOCK = CHUNK_SIZE + 16
 
 
+
+def size_from_env(name, default):
+    """Return the positive byte count in the environment variable `name`
+    and a warning message, which is None unless the value is invalid and
+    `default` is used instead."""
+    value = os.environ.get(name)
+    if value is None:
+        return default, None
+
+    try:
+        size = int(value)
+    except ValueError:
+        size = 0
+    if size <= 0:
+        return default, 'invalid %s=%r, using %d bytes' % (name, value,
+                                                            default)
+    return size, None
+
+
+# upper bound of bytes held by in-flight chunks of all threads,
+# override with the MAES_UI_MEMORY_BUDGET environment variable (in bytes)
+MEMORY_BUDGET_SIZE, MEMORY_BUDGET_WARNING = size_from_env(
+    'MAES_UI_MEMORY_BUDGET', CHUNK_SIZE_AND_A_BLOCK * 64
+)
+
+MEMORY_BUDGET = MemoryBudget(MEMORY_BUDGET_SIZE)
+
+# plain-text log sink, rotated when it grows beyond LOG_FILE_MAX_BYTES,
+# override the path with the MAES_UI_LOG_FILE environment variable
+LOG_FILE_PATH = os.environ.get('MAES_UI_LOG_FILE',
+                               os.path.join(os.path.expanduser('~'),
+                                            '.maes-ui', 'maes-ui.log'))
+LOG_FILE_MAX_BYTES = 1024 * 1024 * 4
+LOG_FILE_BACKUP_COUNT = 5
+
+
 class SettingsDialog(QDialog, object):
     """Settings dialog for EncPanel.
-    Use `get_parameter` to get key and initial vector."""
+    Use `get_parameter` to get key and initial vector,
+    `get_options` to get the optional features as a dict."""
 
     def __init__(self, parent):
         super(SettingsDialog, self).__init__(parent)
@@ -129,6 +168,12 @@ class SettingsDialog(QDialog, object):
         self.init_vector_widget = QLineEdit('00' * 16)
         label.setBuddy(self.init_vector_widget)
 
+        options_label = QLabel('Options')
+        self.digest_check_box = QCheckBox('Write SHA-256 &digests')
+        self.pack_check_box = QCheckBox('Pac&k dropped files '
+                                        'into one archive')
+        self.verify_check_box = QCheckBox('&Verify while encrypting')
+
         button_box = QDialogButtonBox(QDialogButtonBox.Ok |
                                       QDialogButtonBox.Cancel)
 
@@ -148,6 +193,10 @@ class SettingsDialog(QDialog, object):
         _l.addWidget(self.radio_btn_256, 0, 3)
         _l.addWidget(label, 1, 0)
         _l.addWidget(self.init_vector_widget, 1, 1, 1, 3)
+        _l.addWidget(options_label, 2, 0)
+        _l.addWidget(self.digest_check_box, 2, 1, 1, 3)
+        _l.addWidget(self.pack_check_box, 3, 1, 1, 3)
+        _l.addWidget(self.verify_check_box, 4, 1, 1, 3)
         layout.addLayout(_l)
 
         layout.addWidget(button_box)
@@ -223,6 +272,12 @@ class SettingsDialog(QDialog, object):
                  3: 32}[self.key_len_group.checkedId()]
         ]
 
+        self.options = {
+            'compute_digests': self.digest_check_box.isChecked(),
+            'pack_files': self.pack_check_box.isChecked(),
+            'verify_encryption': self.verify_check_box.isChecked()
+        }
+
         return super(SettingsDialog, self).accept()
 
 
@@ -230,6 +285,72 @@ class SettingsDialog(QDialog, object):
         return self.init_vector, self.key
 
 
+    def get_options(self):
+        return dict(self.options)
+
+
+
+class PackEntriesDialog(QDialog, object):
+    """Dialog to pick the entries to extract from a pack.
+    Use `get_selected` to get the checked entries."""
+
+    def __init__(self, parent, entries):
+        super(PackEntriesDialog, self).__init__(parent)
+        self.entries = entries
+
+        self.setup_layout()
+
+
+    def setup_layout(self):
+        self.list_widget = QListWidget()
+        for name, _, size in self.entries:
+            item = QListWidgetItem('%s (%s)' % (
+                name, self.parent().to_human_readable(size)
+            ))
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked)
+            self.list_widget.addItem(item)
+
+        def check_all(state):
+            for i in range(self.list_widget.count()):
+                self.list_widget.item(i).setCheckState(state)
+
+        all_button = QPushButton('Select &all')
+        none_button = QPushButton('Select &none')
+        button_box = QDialogButtonBox(QDialogButtonBox.Ok |
+                                      QDialogButtonBox.Cancel)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.list_widget)
+
+        _l = QHBoxLayout()
+        _l.addWidget(all_button)
+        _l.addWidget(none_button)
+        _l.addStretch()
+        _l.addWidget(button_box)
+        layout.addLayout(_l)
+
+        self.setLayout(layout)
+
+        self.connect(all_button, SIGNAL('clicked()'),
+                     lambda: check_all(Qt.Checked))
+        self.connect(none_button, SIGNAL('clicked()'),
+                     lambda: check_all(Qt.Unchecked))
+        self.connect(button_box, SIGNAL('accepted()'),
+                     self, SLOT('accept()'))
+        self.connect(button_box, SIGNAL('rejected()'),
+                     self, SLOT('reject()'))
+
+        self.setModal(True)
+
+        self.setWindowTitle('Extract')
+
+
+    def get_selected(self):
+        return [entry for i, entry in enumerate(self.entries)
+                if self.list_widget.item(i).checkState() == Qt.Checked]
+
+
 
 class TaskBuffer(QObject, object):
     """Object which buffers tasks for asynchronized task support.
@@ -240,10 +361,13 @@ class TaskBuffer(QObject, object):
     task_finished(str): emitted when self.buffer is empty
 
     slots:
-    extend(l: list): extend buffer
+    extend(l: list): extend buffer, items are either file paths or
+                     (act, file path, output path) tuples which carry
+                     their own action and output path, a list of paths
+                     instead of the file path makes a pack task
     new_task(act: str): activate new task from self.buffer, whether it is an
                         encrypting task or decrypting task is
-                        depended on `act`"""
+                        depended on `act` unless the task carries its own"""
 
     extend_buffer = Signal(list)
     task_finished = Signal(str)
@@ -263,14 +387,26 @@ class TaskBuffer(QObject, object):
     def extend(self, l):
         for item in l:
             self.buffer.append(item)
-            self.logger.info('added %s to buffer', item)
+            fn = item[1] if isinstance(item, tuple) else item
+            if isinstance(fn, list):
+                fn = 'pack of %s' % ', '.join(fn)
+            self.logger.info('added %s to buffer', fn)
         self.refresh_buffer_label()
 
 
     @Slot(str)
     def new_task(self, act):
         if self.buffer:
-            self.target.start_task.emit(act, self.buffer.pop(0))
+            item = self.buffer.pop(0)
+            if isinstance(item, tuple):
+                act, fn, out_fn = item
+            else:
+                fn, out_fn = item, ''
+
+            if isinstance(fn, list):
+                self.target.start_pack_task.emit(fn)
+            else:
+                self.target.start_task.emit(act, fn, out_fn)
         else:
             self.target.all_task_done.emit()
         self.refresh_buffer_label()
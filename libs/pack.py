@@ -0,0 +1,353 @@
+# encoding: utf-8
+"""Packs many files into one stream which is encrypted as a whole.
+
+Plaintext layout of a pack, every section starts at a block boundary:
+
+    preamble    MAGIC, format version and index size (`PREAMBLE`)
+    index       for every entry its size and utf-8 name (`ENTRY_HEADER`),
+                names are relative and '/' separated, padded to a block
+    data        content of the entries back to back, padded to a block
+
+As the stream is block aligned, any range of it can be decrypted on its
+own with the preceding ciphertext block as initial vector, which is how
+single entries are extracted without decrypting the whole pack."""
+from multiprocessing.pool import ThreadPool
+import os
+import Queue
+import struct
+import threading
+from libs import maes
+from libs.budget import MemoryBudget
+
+
+PACK_SUFFIX = '.maespack'
+
+MAGIC = 'MAESPACK'
+VERSION = 1
+BLOCK_SIZE = 16
+
+PREAMBLE = struct.Struct('>8sII')
+ENTRY_HEADER = struct.Struct('>QH')
+
+# files up to this size are read ahead by the pool, larger ones are
+# streamed when their turn comes
+PREFETCH_SIZE = 8192 * 128
+PREFETCH_THREADS = 8
+PREFETCH_QUEUE_SIZE = 1024
+# upper bound of the read-ahead share taken from the process budget
+READAHEAD_SIZE = 1024 * 1024 * 16
+
+
+class PackError(Exception):
+    pass
+
+
+
+def padding(size):
+    return '\x00' * (-size % BLOCK_SIZE)
+
+
+def collect_entries(paths):
+    """Expand directories in `paths`, returns (path, name, size) tuples.
+    Entries of a directory are named relative to its parent, so the
+    directory itself shows up in the pack."""
+    entries = []
+    names = set()
+
+    def add(path, name):
+        name = name.replace(os.sep, '/')
+        if name in names:
+            raise PackError('duplicate entry %s' % name)
+        names.add(name)
+        entries.append((path, name, os.path.getsize(path)))
+
+    for path in paths:
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            add(path, os.path.basename(path))
+            continue
+
+        parent = os.path.dirname(path)
+        for dir_path, dir_names, fns in os.walk(path):
+            dir_names.sort()
+            for fn in sorted(fns):
+                full_path = os.path.join(dir_path, fn)
+                add(full_path, os.path.relpath(full_path, parent))
+
+    return entries
+
+
+def build_index(entries):
+    index = []
+    for _, name, size in entries:
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        index.append(ENTRY_HEADER.pack(size, len(name)))
+        index.append(name)
+    index = ''.join(index)
+
+    return PREAMBLE.pack(MAGIC, VERSION, len(index)) + index +\
+           padding(len(index))
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+
+class PackReader(object):
+    """File-like object producing the plaintext stream of a pack, so that
+    it can be fed to `_cipher_bootstrap` like any other input file.
+
+    Small files are read concurrently by a thread pool in the background.
+    The read-ahead takes a fixed share of `budget` up front, at most half
+    of what is left after `keep_free` bytes for the reading side, and
+    accounts the files it holds within that share only, so it never
+    competes with the cipher loop for the rest of `budget`. Files which
+    do not fit into the share are streamed when their turn comes."""
+
+    def __init__(self, entries, budget, keep_free,
+                 threads=PREFETCH_THREADS):
+        self.entries = entries
+        self.budget = budget
+        self.name = '<pack of %d files>' % len(entries)
+
+        self.share = max(0, min(READAHEAD_SIZE,
+                                (budget.limit - keep_free) // 2))
+        self.readahead = MemoryBudget(self.share)
+        self.prefetch_size = min(PREFETCH_SIZE, self.share)
+        budget.acquire(self.share)
+
+        header = build_index(entries)
+        self._data_size = sum(size for _, _, size in entries)
+        self.size = len(header) + self._data_size +\
+                    len(padding(self._data_size))
+
+        self._pieces = [header]
+        self._pending = ''
+        self._current = None
+        self._finished = False
+        self._closed = False
+
+        self._pool = ThreadPool(threads)
+        self._queue = Queue.Queue(PREFETCH_QUEUE_SIZE)
+        self._producer = threading.Thread(target=self._produce)
+        self._producer.daemon = True
+        self._producer.start()
+
+
+    def _produce(self):
+        for path, name, size in self.entries:
+            if self._closed:
+                break
+            if size > self.prefetch_size:
+                self._queue.put((path, name, size, None))
+                continue
+
+            # acquired in order from the reader's own share, so the entry
+            # needed next never waits for bytes held by entries behind it
+            # and the cipher loop's reservations never block it
+            self.readahead.acquire(size)
+            if self._closed:
+                self.readahead.release(size)
+                break
+            self._queue.put((path, name, size,
+                             self._pool.apply_async(read_file, (path,))))
+        self._queue.put(None)
+
+
+    def _next_piece(self, want):
+        if self._current is not None:
+            fp, name, left = self._current
+            data = fp.read(min(want, left, PREFETCH_SIZE))
+            left -= len(data)
+            if not data or not left:
+                fp.close()
+                self._current = None
+                if left:
+                    raise PackError('%s shrank while packing' % name)
+            else:
+                self._current = fp, name, left
+            return data
+
+        if self._pieces:
+            return self._pieces.pop(0)
+        if self._finished:
+            return ''
+
+        item = self._queue.get()
+        if item is None:
+            self._finished = True
+            return padding(self._data_size)
+
+        path, name, size, result = item
+        if result is None:
+            self._current = open(path, 'rb'), name, size
+            return ''
+
+        try:
+            data = result.get()
+        finally:
+            self.readahead.release(size)
+        if len(data) != size:
+            raise PackError('%s changed while packing' % name)
+        return data
+
+
+    def read(self, size):
+        chunks = []
+        have = 0
+        while have < size:
+            if not self._pending:
+                self._pending = self._next_piece(size - have)
+                if not self._pending:
+                    if self._finished and self._current is None and\
+                            not self._pieces:
+                        break
+                    continue
+
+            piece = self._pending[:size - have]
+            self._pending = self._pending[len(piece):]
+            chunks.append(piece)
+            have += len(piece)
+
+        return ''.join(chunks)
+
+
+    def close(self):
+        self._closed = True
+
+        # drain the queue so the producer can finish and the budget
+        # held by read-ahead entries is given back
+        while self._producer.is_alive() or not self._queue.empty():
+            try:
+                item = self._queue.get(timeout=.1)
+            except Queue.Empty:
+                continue
+            if item is not None and item[3] is not None:
+                item[3].wait()
+                self.readahead.release(item[2])
+
+        if self._current is not None:
+            self._current[0].close()
+            self._current = None
+
+        self._pool.close()
+        self._pool.join()
+
+        if self.share is not None:
+            self.budget.release(self.share)
+            self.share = None
+
+
+
+def read_index(in_fp, key, init_vector):
+    """Decrypt the index of the pack `in_fp`, returns a list of
+    (name, offset, size) tuples, offsets are into the plaintext stream."""
+    maes.encrypt('\x00' * 16, key)
+
+    in_fp.seek(0, os.SEEK_SET)
+    preamble, next_vector = maes.inv_cbc_aes(in_fp.read(PREAMBLE.size),
+                                             init_vector)
+    magic, version, index_size = PREAMBLE.unpack(preamble)
+    if magic != MAGIC:
+        raise PackError('not a pack or wrong key')
+    if version != VERSION:
+        raise PackError('unsupported pack version %d' % version)
+
+    if not index_size:
+        return []
+    index_size += len(padding(index_size))
+    index, _ = maes.inv_cbc_aes(in_fp.read(index_size), next_vector)
+
+    entries = []
+    pos = 0
+    offset = PREAMBLE.size + index_size
+    while pos + ENTRY_HEADER.size <= len(index):
+        size, name_len = ENTRY_HEADER.unpack_from(index, pos)
+        if not name_len:
+            # reached the padding
+            break
+        pos += ENTRY_HEADER.size
+        name = index[pos:pos + name_len].decode('utf-8')
+        pos += name_len
+
+        entries.append((name, offset, size))
+        offset += size
+
+    return entries
+
+
+def decrypt_range(in_fp, init_vector, start, end, budget, chunk_size):
+    """Yield the plaintext of [`start`, `end`) of the pack `in_fp`,
+    decrypting only the blocks which cover that range."""
+    block_start = start - start % BLOCK_SIZE
+    block_end = end + len(padding(end))
+
+    if block_start:
+        in_fp.seek(block_start - BLOCK_SIZE, os.SEEK_SET)
+        init_vector = in_fp.read(BLOCK_SIZE)
+    else:
+        in_fp.seek(0, os.SEEK_SET)
+
+    skip = start - block_start
+    pos = block_start
+    while pos < block_end:
+        size = min(chunk_size, block_end - pos)
+
+        with budget.reserve(2 * size):
+            text, init_vector = maes.inv_cbc_aes(in_fp.read(size),
+                                                 init_vector)
+            pos += size
+
+            text = text[skip:len(text) - max(pos - end, 0)]
+            skip = 0
+        yield text
+
+
+
+class PackExtractor(object):
+    """Writes entries of a pack below `out_dir`. Stands in for the output
+    file of an extraction task."""
+
+    def __init__(self, out_dir, entries, budget, chunk_size):
+        self.name = out_dir
+        self.entries = entries
+        self.budget = budget
+        self.chunk_size = chunk_size
+
+        self.size = sum(size for _, _, size in entries)
+
+
+    def target_path(self, name):
+        parts = name.split('/')
+        if name.startswith('/') or os.pardir in parts:
+            raise PackError('unsafe entry name %s' % name)
+        return os.path.join(self.name, *parts)
+
+
+    def extract(self, in_fp, key, init_vector, round_callback):
+        maes.encrypt('\x00' * 16, key)
+
+        processed_size = 0.
+        for name, offset, size in self.entries:
+            path = self.target_path(name)
+            dir_path = os.path.dirname(path)
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+
+            with open(path, 'wb') as f:
+                for text in decrypt_range(in_fp, init_vector,
+                                          offset, offset + size,
+                                          self.budget, self.chunk_size):
+                    if not text:
+                        continue
+                    f.write(text)
+                    processed_size += len(text)
+
+                    round_callback(processed_size, len(text))
+
+
+    def close(self):
+        pass
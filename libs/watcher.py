@@ -0,0 +1,231 @@
+# encoding: utf-8
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+
+# seconds a file has to stay untouched before it is handed over
+DEBOUNCE = 2.
+POLL_INTERVAL = 1.
+
+
+class FolderWatcher(threading.Thread):
+    """Base class of the watchers, calls `callback(path)` from the watcher
+    thread for every file under `watch_dir` which is written completely.
+
+    A file becomes pending whenever it is touched and is handed over once
+    it has not been touched for `debounce` seconds, so partial writes are
+    never picked up.
+
+    This class is abstract, subclasses must implement
+    `wait_events(timeout)`, which waits up to `timeout` seconds for changes
+    and calls `touch` for every file written to, and may override
+    `cleanup()` to release their resources when watching stops."""
+
+    def __init__(self, watch_dir, callback, logger, debounce=DEBOUNCE):
+        super(FolderWatcher, self).__init__()
+        self.daemon = True
+
+        self.watch_dir = os.path.abspath(watch_dir)
+        self.callback = callback
+        self.logger = logger
+        self.debounce = debounce
+
+        self.pending = {}
+        self._stopped = threading.Event()
+
+
+    def touch(self, path):
+        self.pending[path] = time.time()
+
+
+    def flush_pending(self):
+        now = time.time()
+        for path, last_touched in self.pending.items():
+            if now - last_touched < self.debounce:
+                continue
+
+            del self.pending[path]
+            if os.path.isfile(path):
+                self.callback(path)
+
+
+    def run(self):
+        self.logger.info('watching %s (%s)', self.watch_dir, self.name)
+        try:
+            while not self._stopped.is_set():
+                self.wait_events(min(self.debounce, POLL_INTERVAL) / 2)
+                self.flush_pending()
+        finally:
+            self.cleanup()
+        self.logger.info('stopped watching %s', self.watch_dir)
+
+
+    def cleanup(self):
+        pass
+
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+
+class PollingWatcher(FolderWatcher):
+    """Fallback watcher which rescans `watch_dir` every `POLL_INTERVAL`
+    seconds and treats a changed size or mtime as a touch. Files which
+    exist when watching starts are ignored."""
+
+    def __init__(self, watch_dir, callback, logger, debounce=DEBOUNCE):
+        super(PollingWatcher, self).__init__(watch_dir, callback, logger,
+                                             debounce)
+        self.name = 'polling'
+
+        self.last_scan = 0
+        self.snapshot = self.scan()
+
+
+    def scan(self):
+        snapshot = {}
+        for dir_path, _, fns in os.walk(self.watch_dir):
+            for fn in fns:
+                path = os.path.join(dir_path, fn)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = st.st_size, st.st_mtime
+        return snapshot
+
+
+    def wait_events(self, timeout):
+        self._stopped.wait(timeout)
+        if time.time() - self.last_scan < POLL_INTERVAL:
+            return
+
+        self.last_scan = time.time()
+        snapshot = self.scan()
+        for path, state in snapshot.iteritems():
+            if self.snapshot.get(path) != state:
+                self.touch(path)
+        self.snapshot = snapshot
+
+
+
+class InotifyWatcher(FolderWatcher):
+    """Watcher driven by Linux inotify, never rescans `watch_dir` after
+    the watches are set up. Raises `OSError` if inotify is unavailable."""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, watch_dir, callback, logger, debounce=DEBOUNCE):
+        super(InotifyWatcher, self).__init__(watch_dir, callback, logger,
+                                             debounce)
+        self.name = 'inotify'
+
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+
+        self.watches = {}
+        self.add_watches(self.watch_dir)
+
+
+    def add_watches(self, top):
+        """Watch `top` and every directory under it, returns the files
+        found in directories which were not watched before."""
+        found = []
+        for dir_path, _, fns in os.walk(top):
+            path = dir_path
+            if isinstance(path, unicode):
+                path = path.encode(sys.getfilesystemencoding())
+
+            wd = self.libc.inotify_add_watch(self.fd, path, self.MASK)
+            if wd < 0:
+                self.logger.warning('cannot watch %s: %s', dir_path,
+                                    os.strerror(ctypes.get_errno()))
+                continue
+            self.watches[wd] = dir_path
+            found.extend(os.path.join(dir_path, fn) for fn in fns)
+        return found
+
+
+    def wait_events(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+
+        buf = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, name_len = self.EVENT_HEADER.unpack_from(buf,
+                                                                  offset)
+            offset += self.EVENT_HEADER.size
+            name = buf[offset:offset + name_len].rstrip('\0')
+            offset += name_len
+
+            self.handle_event(wd, mask, name)
+
+
+    def handle_event(self, wd, mask, name):
+        if mask & self.IN_Q_OVERFLOW:
+            self.logger.warning('inotify queue overflowed, '
+                                'some files may be missed')
+            return
+        if mask & self.IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+
+        dir_path = self.watches.get(wd)
+        if dir_path is None or not name:
+            return
+        if isinstance(dir_path, unicode):
+            name = name.decode(sys.getfilesystemencoding())
+        path = os.path.join(dir_path, name)
+
+        if mask & self.IN_ISDIR:
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                for fn in self.add_watches(path):
+                    self.touch(fn)
+        elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+            self.touch(path)
+        elif mask & self.IN_MODIFY and path in self.pending:
+            # written again after a close, start debouncing anew
+            self.touch(path)
+
+
+    def cleanup(self):
+        os.close(self.fd)
+
+
+
+def make_watcher(watch_dir, callback, logger, debounce=DEBOUNCE):
+    """Return an inotify watcher, or a polling one where inotify is not
+    available."""
+    try:
+        return InotifyWatcher(watch_dir, callback, logger, debounce)
+    except (OSError, AttributeError) as e:
+        logger.warning('inotify unavailable (%s), falling back to polling',
+                       e)
+        return PollingWatcher(watch_dir, callback, logger, debounce)
@@ -0,0 +1,180 @@
+# encoding: utf-8
+import hashlib
+import os
+import Queue
+import threading
+from libs import maes
+
+
+BLOCK_SIZE = 16
+
+
+class ChunkWorker(threading.Thread):
+    """Runs `handlers` over the chunks `_cipher_bootstrap` hands over,
+    in a helper thread so that the cipher loop does not wait for them.
+
+    Every chunk is submitted together with the bytes it holds in `budget`,
+    the worker releases them after all handlers have seen the chunk.
+
+    handler interface:
+    update(offset, in_text, out_text, init_vector): called for every chunk,
+                                                    `init_vector` is the one
+                                                    the chunk was processed
+                                                    with
+    finish(): called once after the last chunk"""
+
+    _sentinel = None
+
+    def __init__(self, budget, *handlers):
+        super(ChunkWorker, self).__init__()
+        self.daemon = True
+
+        self.budget = budget
+        self.handlers = handlers
+        self.queue = Queue.Queue()
+        self.error = None
+        self.aborted = False
+
+
+    def submit(self, offset, in_text, out_text, init_vector, reserved):
+        self.queue.put((offset, in_text, out_text, init_vector, reserved))
+
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is self._sentinel:
+                break
+
+            offset, in_text, out_text, init_vector, reserved = item
+            del item
+            try:
+                if self.error is None and not self.aborted:
+                    for handler in self.handlers:
+                        handler.update(offset, in_text, out_text,
+                                       init_vector)
+            except Exception as e:
+                self.error = e
+            finally:
+                # drop the chunks before giving their bytes back
+                del in_text, out_text
+                self.budget.release(reserved)
+
+
+    def finish(self):
+        """Wait for the submitted chunks and finish the handlers, raises
+        the first error a handler ran into."""
+        self.queue.put(self._sentinel)
+        self.join()
+
+        if self.error is not None:
+            raise self.error
+
+        for handler in self.handlers:
+            handler.finish()
+
+
+    def abort(self):
+        """Give back the bytes of the submitted chunks without running the
+        handlers on them or finishing the handlers, for tasks which failed
+        elsewhere and whose results must not be reported."""
+        self.aborted = True
+        self.queue.put(self._sentinel)
+        self.join()
+
+
+
+class VerificationError(Exception):
+    def __init__(self, offset):
+        super(VerificationError, self).__init__(
+            'round trip mismatch at offset %d' % offset
+        )
+        self.offset = offset
+
+
+
+class VerifyHandler(object):
+    """Decrypts every ciphertext chunk with the initial vector it was
+    encrypted with and compares it to the plaintext chunk, so verifying
+    costs no extra I/O.
+
+    The last chunk is padded to a whole block, so its decrypted text may
+    be longer than the plaintext by less than a block."""
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.verified_size = 0
+
+
+    def update(self, offset, in_text, out_text, init_vector):
+        plain_text, _ = maes.inv_cbc_aes(out_text, init_vector)
+        padding_size = len(plain_text) - len(in_text)
+        if plain_text[:len(in_text)] != in_text or\
+                not 0 <= padding_size < BLOCK_SIZE:
+            for i, (a, b) in enumerate(zip(plain_text, in_text)):
+                if a != b:
+                    break
+            else:
+                i = min(len(plain_text), len(in_text))
+            raise VerificationError(offset + i)
+
+        self.verified_size += len(in_text)
+
+
+    def finish(self):
+        self.logger.info('verified %d bytes', self.verified_size)
+
+
+
+class DigestHandler(object):
+    """Hashes input and output chunks in a single pass and writes them
+    into a sidecar file in `sha256sum` format, listed relative to the
+    sidecar. Pass None as `in_fn` when the input is not a file, only the
+    output is hashed then."""
+
+    def __init__(self, in_fn, out_fn, sidecar_fn, logger,
+                 algorithm='sha256'):
+        self.sidecar_fn = sidecar_fn
+        self.logger = logger
+
+        self.in_hash = hashlib.new(algorithm) if in_fn is not None else None
+        self.out_hash = hashlib.new(algorithm)
+
+        self.hashes = [(out_fn, self.out_hash)]
+        if self.in_hash is not None:
+            self.hashes.insert(0, (in_fn, self.in_hash))
+
+
+    def update(self, offset, in_text, out_text, init_vector):
+        if self.in_hash is not None:
+            self.in_hash.update(in_text)
+        self.out_hash.update(out_text)
+
+
+    def listed_path(self, fn):
+        """Path of `fn` as `sha256sum -c` run next to the sidecar expects
+        it, absolute if `fn` is not below the sidecar's directory."""
+        fn = os.path.abspath(fn)
+        path = os.path.relpath(
+            fn, os.path.dirname(os.path.abspath(self.sidecar_fn))
+        )
+        if path == os.pardir or path.startswith(os.pardir + os.sep):
+            return fn
+        return path
+
+
+    def hexdigests(self):
+        return [(fn, h.hexdigest()) for fn, h in self.hashes]
+
+
+    def finish(self):
+        digests = self.hexdigests()
+
+        with open(self.sidecar_fn, 'w') as f:
+            for fn, digest in digests:
+                f.write('%s  %s\n' % (digest, self.listed_path(fn)))
+
+        for fn, digest in digests:
+            self.logger.info('%s %s %s',
+                             self.out_hash.name, digest, fn)
+        self.logger.debug('wrote digests to %s', self.sidecar_fn)
@@ -1,15 +1,28 @@
 # encoding: utf-8
 from contextlib import contextmanager
+import errno
 import logging
+import logging.handlers
 import os
+import Queue
+import sqlite3
+import struct
 import threading
 from PySide.QtGui import *
 from PySide.QtCore import *
 import sys
 import time
-from libs.logger import LoggerHandler, ColoredFormatter
+from libs.logger import LoggerHandler, ColoredFormatter, QueueHandler, QueueListener
 from libs import maes
 from libs.misc import CHUNK_SIZE_AND_A_BLOCK, CHUNK_SIZE, SettingsDialog, TaskBuffer
+from libs.misc import PackEntriesDialog
+from libs.misc import MEMORY_BUDGET, MEMORY_BUDGET_WARNING
+from libs.misc import LOG_FILE_PATH, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUP_COUNT
+from libs.workers import ChunkWorker, DigestHandler, VerifyHandler
+from libs.watcher import make_watcher
+from libs.pack import PACK_SUFFIX, PackError, PackReader, PackExtractor
+from libs.pack import collect_entries, read_index
+from libs.history import ThroughputHistory
 
 
 logging.basicConfig()
@@ -20,14 +33,23 @@ class EncPanel(QDialog, object):
 
     signals:
     accept_drops(bool): emitted when panel changes drop policy
-    start_task(str, str): emitted when new task is to start
+    start_task(str, str, str): emitted when new task is to start
+    start_pack_task(list): emitted when a buffered pack is to start
     all_task_done(): emitted task buffer is empty
+    watched_file_ready(str): emitted when a file in the watched folder
+                             is written completely
     other widget signals are omitted
 
     slots:
     finalize_task_buffer(): reset panel state to initial state
-    start_new_task(act: str, fn: str): start new task,
-                                       args are action type and file path"""
+    start_new_task(act: str, fn: str, out_fn: str): start new task,
+                                                    args are action type,
+                                                    file path and output
+                                                    path, empty for the
+                                                    default one
+    enqueue_watched_file(fn: str): encrypt `fn` now or after the running
+                                   tasks
+    run_pack(fns: list): pack `fns` now"""
 
     A_MILLION_BYTE = 1024 * 1000
 
@@ -35,21 +57,34 @@ class EncPanel(QDialog, object):
     ACT_DEC = 'decryption'
 
     accept_drops = Signal(bool)
-    start_task = Signal(str, str)
+    start_task = Signal(str, str, str)
+    start_pack_task = Signal(list)
     all_task_done = Signal()
+    watched_file_ready = Signal(str)
 
     def __init__(self):
         super(EncPanel, self).__init__()
 
         self.last_directory = '.'
+        self.busy = False
+        self.watcher = None
+        self.mirror_dir = None
+        self.history = ThroughputHistory()
 
         self.setup_layout()
         self.setup_logger()
         self.setup_settings_dialog()
 
+        if MEMORY_BUDGET_WARNING:
+            self.logger.warning(MEMORY_BUDGET_WARNING)
+
         self.accept_drops.connect(lambda b: self.setAcceptDrops(b))
         self.start_task.connect(self.start_new_task)
+        self.start_pack_task.connect(self.run_pack)
         self.all_task_done.connect(self.finalize_task_buffer)
+        self.watched_file_ready.connect(self.enqueue_watched_file)
+        self.finished.connect(self.stop_watching)
+        self.finished.connect(self.teardown_logger)
 
         self.task_buffer = TaskBuffer(self, self.logger)
 
@@ -64,15 +99,17 @@ class EncPanel(QDialog, object):
 
     @Slot()
     def finalize_task_buffer(self):
+        self.busy = False
+
         self.enc_button.emit(SIGNAL('enabled()'))
         self.dec_button.emit(SIGNAL('enabled()'))
 
         self.reset_idleness()
 
 
-    @Slot(str, str)
-    def start_new_task(self, act, fn):
-        self.echo_selected_file(fn, '%s.aes' % fn)
+    @Slot(str, str, str)
+    def start_new_task(self, act, fn, out_fn=''):
+        self.echo_selected_file(fn, out_fn or self.output_path_for(fn, act))
 
         if act == self.ACT_ENC:
             self.start_enc()
@@ -81,6 +118,8 @@ class EncPanel(QDialog, object):
 
 
     def setup_logger(self):
+        """Worker threads only enqueue records, a single listener thread
+        formats them for the log widget and the rotating log file."""
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.DEBUG)
 
@@ -92,13 +131,57 @@ class EncPanel(QDialog, object):
             datefmt='%H:%M',
             colors={'levelname': lambda lvl: color_scheme[lvl]}
         ))
-        self.logger.addHandler(handler)
+        handlers = [handler]
+
+        try:
+            log_dir = os.path.dirname(LOG_FILE_PATH)
+            if log_dir and not os.path.isdir(log_dir):
+                os.makedirs(log_dir)
+            file_handler = logging.handlers.RotatingFileHandler(
+                LOG_FILE_PATH,
+                maxBytes=LOG_FILE_MAX_BYTES,
+                backupCount=LOG_FILE_BACKUP_COUNT
+            )
+        except (IOError, OSError) as e:
+            file_handler = None
+            log_file_error = e
+        else:
+            file_handler.setFormatter(logging.Formatter(
+                fmt='%(asctime)s [%(levelname)s] %(threadName)s %(message)s'
+            ))
+            handlers.append(file_handler)
+
+        log_queue = Queue.Queue()
+        self.log_listener = QueueListener(log_queue, *handlers)
+        self.log_queue_handler = QueueHandler(log_queue)
+        self.logger.addHandler(self.log_queue_handler)
+        self.logger.propagate = False
 
         self.connect(self.text_browser,
                      SIGNAL('new_log(QString)'),
                      self.text_browser,
                      SLOT('append(QString)'))
 
+        self.log_listener.start()
+
+        if file_handler is None:
+            self.logger.warning('cannot open log file %s: %s',
+                                LOG_FILE_PATH, log_file_error)
+
+
+    @Slot(int)
+    def teardown_logger(self, result):
+        """Tasks may still be running when the panel is closed, so their
+        records go to the handlers directly from now on. The listener
+        handles what is queued before it stops."""
+        if self.log_queue_handler not in self.logger.handlers:
+            return
+
+        for handler in self.log_listener.handlers:
+            self.logger.addHandler(handler)
+        self.logger.removeHandler(self.log_queue_handler)
+        self.log_listener.stop()
+
 
     def setup_layout(self):
         self.text_browser = QTextBrowser()
@@ -144,14 +227,14 @@ class EncPanel(QDialog, object):
 
         grid = QGridLayout()
 
-        grid.addWidget(self.text_browser, 0, 0, 1, 4)
+        grid.addWidget(self.text_browser, 0, 0, 1, 5)
 
-        grid.addWidget(self.progress, 1, 0, 1, 4)
+        grid.addWidget(self.progress, 1, 0, 1, 5)
 
         grid.addWidget(in_label, 2, 0)
-        grid.addWidget(self.file_path_in, 2, 1, 1, 3)
+        grid.addWidget(self.file_path_in, 2, 1, 1, 4)
         grid.addWidget(out_label, 3, 0)
-        grid.addWidget(self.file_path_out, 3, 1, 1, 3)
+        grid.addWidget(self.file_path_out, 3, 1, 1, 4)
 
         grid.addWidget(new_button('open_button',
                                   '&Open...',
@@ -165,6 +248,9 @@ class EncPanel(QDialog, object):
         grid.addWidget(new_button('settings_button',
                                   '&Settings...',
                                   self.show_settings_dialog), 4, 3)
+        grid.addWidget(new_button('watch_button',
+                                  '&Watch...',
+                                  self.toggle_watching), 4, 4)
 
         h = QHBoxLayout()
         h.addWidget(new_status_label('idleness'))
@@ -172,7 +258,7 @@ class EncPanel(QDialog, object):
         h.addWidget(new_status_label('processed_size'))
         h.addWidget(new_status_label('instant_speed'))
         h.addWidget(new_status_label('buffer_rest'))
-        grid.addLayout(h, 5, 0, 1, 4)
+        grid.addLayout(h, 5, 0, 1, 5)
 
         self.setLayout(grid)
 
@@ -188,22 +274,47 @@ class EncPanel(QDialog, object):
         if not fns:
             return
 
+        if len(fns) > 1 and self.options['pack_files']:
+            self.extend_or_pack(fns)
+            return
+
         fn = fns[0]
 
         self.last_directory = os.path.dirname(fn)
 
-        self.echo_selected_file(fn, '%s.aes' % fn)
+        self.echo_selected_file(fn, self.output_path_for(fn))
 
         self.emit_extend_buffer(fns[1:])
 
 
+    @staticmethod
+    def is_outside(rel_path):
+        return rel_path == os.pardir or\
+               rel_path.startswith(os.pardir + os.sep)
+
+
+    def output_path_for(self, fn, act=None):
+        """Files from the watched folder go to the same relative path
+        under the mirror folder, packs to be decrypted are extracted into
+        a folder named after them, other files go next to themselves."""
+        if self.watcher is not None:
+            rel = os.path.relpath(os.path.abspath(fn), self.watcher.watch_dir)
+            if not self.is_outside(rel):
+                return os.path.join(self.mirror_dir, '%s.aes' % rel)
+
+        if act == self.ACT_DEC and fn.endswith(PACK_SUFFIX):
+            return fn[:-len(PACK_SUFFIX)]
+
+        return '%s.aes' % fn
+
+
     def echo_selected_file(self, in_fn, out_fn):
         self.file_path_in.setText(in_fn)
         self.file_path_out.setText(out_fn)
         self.logger.info('selected %s', in_fn)
 
 
-    def open_files(self):
+    def open_files(self, act):
         in_fn = self.file_path_in.text()
         out_fn = self.file_path_out.text()
 
@@ -214,15 +325,30 @@ class EncPanel(QDialog, object):
             in_fn = self.file_path_in.text()
             out_fn = self.file_path_out.text()
 
-            if not in_fn:
+            # the selection may have started a pack instead
+            if not in_fn or self.busy:
                 return ret_failed
 
         if not out_fn:
             self.logger.error('please specify output path')
             return ret_failed
 
-        in_fp = open(in_fn, 'rb')
-        out_fp = open(out_fn, 'wb')
+        in_fp = None
+        try:
+            out_dir = os.path.dirname(out_fn)
+            if out_dir and not os.path.isdir(out_dir):
+                os.makedirs(out_dir)
+
+            in_fp = open(in_fn, 'rb')
+            out_fp = open(out_fn, 'wb')
+        except (IOError, OSError) as e:
+            if in_fp is not None:
+                in_fp.close()
+            self.logger.error('cannot open %s: %s', e.filename or in_fn,
+                              e.strerror or e)
+            self.skip_task(act)
+            return ret_failed
+
         self.logger.debug('opened file handler %s', in_fn)
         self.logger.debug('opened file handler %s', out_fn)
 
@@ -236,6 +362,16 @@ class EncPanel(QDialog, object):
         return in_fp, out_fp, size
 
 
+    def skip_task(self, act):
+        """Clear the paths and let the buffer move on to its next task,
+        queued so that a run of vanished files does not recurse."""
+        self.file_path_in.setText('')
+        self.file_path_out.setText('')
+
+        task_finished = self.task_buffer.task_finished
+        QTimer.singleShot(0, lambda: task_finished.emit(act))
+
+
     def setup_settings_dialog(self):
         self.init_vector = '\x00' * 16
         self.key = '\x01\x23\x45\x67\x89\xab\xcd\xef' * 2
@@ -243,6 +379,7 @@ class EncPanel(QDialog, object):
         self.settings_dialog = SettingsDialog(self)
         self.settings_dialog.accept()
         self.init_vector, self.key = self.settings_dialog.get_parameters()
+        self.options = self.settings_dialog.get_options()
 
 
     def show_settings_dialog(self):
@@ -260,12 +397,21 @@ class EncPanel(QDialog, object):
                 else:
                     self.logger.info('key changed')
 
+            last_options = self.options
+            self.options = self.settings_dialog.get_options()
+            for name in sorted(self.options):
+                if last_options[name] != self.options[name]:
+                    self.logger.info('%s %s', name.replace('_', ' '),
+                                     'enabled' if self.options[name]
+                                     else 'disabled')
+
 
     @staticmethod
     def _cipher_bootstrap(func,
                           key, init_vector,
                           in_fp, out_fp, size,
-                          round_callback):
+                          round_callback,
+                          worker=None):
         maes.encrypt('\x00' * 16, key)
 
         rest_size = size
@@ -278,9 +424,32 @@ class EncPanel(QDialog, object):
                 size = CHUNK_SIZE
             else:
                 size = rest_size
-            out_text, init_vector = func(in_fp.read(size),
-                                         init_vector)
-            out_fp.write(out_text)
+
+            # both the input chunk and its output (plus a padding block)
+            # are alive at the same time
+            reserved = 2 * size + 16
+            MEMORY_BUDGET.acquire(reserved)
+            try:
+                in_text = in_fp.read(size)
+                out_text, next_vector = func(in_text, init_vector)
+                out_fp.write(out_text)
+            except:
+                MEMORY_BUDGET.release(reserved)
+                raise
+
+            if worker is None:
+                del in_text, out_text
+                MEMORY_BUDGET.release(reserved)
+            else:
+                # the worker owns the reservation from now on
+                worker.submit(int(processed_size),
+                              in_text, out_text, init_vector,
+                              reserved)
+                del in_text, out_text
+                if worker.error is not None:
+                    raise worker.error
+
+            init_vector = next_vector
             rest_size -= size
             processed_size += size
 
@@ -304,19 +473,36 @@ class EncPanel(QDialog, object):
 
 
     @contextmanager
-    def action(self, act, in_fp, out_fp, size):
+    def action(self, act, in_fp, out_fp, size, worker=None):
         act = self.ACT_ENC if act == maes.cbc_aes else self.ACT_DEC
 
+        MEMORY_BUDGET.reset_peak()
         self.start_time = self.last_time = time.time()
 
         self.logger.info('beginning %s with %d-bit key',
                          act, len(self.key) * 8)
 
-        yield
+        if worker is not None:
+            worker.start()
+
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
 
         in_fp.close()
         out_fp.close()
 
+        if worker is not None and error is not None:
+            # digests and verified sizes of a failed task are meaningless
+            worker.abort()
+        elif worker is not None:
+            try:
+                worker.finish()
+            except Exception as e:
+                error = e
+
         time_elapsed = self.last_time - self.start_time
         if time_elapsed > 0:
             t = ('%.2f sec' % time_elapsed) +\
@@ -330,18 +516,66 @@ class EncPanel(QDialog, object):
         self.file_path_in.emit(SIGNAL('clear(QString)'), '')
         self.file_path_out.emit(SIGNAL('clear(QString)'), '')
 
-        self.logger.info('%s done within %s, average speed %s',
-                         act, t, avg_speed)
+        if error is None:
+            self.logger.info('%s done within %s, average speed %s',
+                             act, t, avg_speed)
+            try:
+                self.history.record(act, len(self.key) * 8, size,
+                                    time_elapsed, CHUNK_SIZE)
+            except (sqlite3.Error, OSError) as e:
+                self.logger.warning('cannot record throughput history: %s',
+                                    e)
+        elif act == self.ACT_ENC and isinstance(out_fp, file):
+            # never leave a known-bad ciphertext under its final name
+            failed_fn = '%s.failed' % out_fp.name
+            try:
+                if os.path.exists(failed_fn):
+                    os.remove(failed_fn)
+                os.rename(out_fp.name, failed_fn)
+            except OSError as e:
+                self.logger.error('%s of %s aborted: %s, cannot move away '
+                                  'partial output %s: %s',
+                                  act, in_fp.name, error, out_fp.name, e)
+            else:
+                self.logger.error('%s of %s aborted: %s, partial output '
+                                  'moved to %s',
+                                  act, in_fp.name, error, failed_fn)
+        else:
+            self.logger.error('%s of %s aborted: %s', act, in_fp.name, error)
+
+        current, peak, limit = MEMORY_BUDGET.usage()
+        self.logger.debug('memory budget: %s in use, task peak %s of %s',
+                          self.to_human_readable(current),
+                          self.to_human_readable(peak),
+                          self.to_human_readable(limit))
         self.task_buffer.task_finished.emit(act)
 
 
+    def make_chunk_worker(self, action, in_fp, out_fp):
+        handlers = []
+        if self.options['verify_encryption'] and action == maes.cbc_aes:
+            handlers.append(VerifyHandler(self.logger))
+        if self.options['compute_digests']:
+            # packs are read from a stream, not from a single file
+            in_fn = in_fp.name if isinstance(in_fp, file) else None
+            handlers.append(DigestHandler(in_fn, out_fp.name,
+                                          '%s.sha256' % out_fp.name,
+                                          self.logger))
+
+        if not handlers:
+            return None
+        return ChunkWorker(MEMORY_BUDGET, *handlers)
+
+
     def start_action(self, action, file_state, round_callback):
         def _(in_fp, out_fp, size):
-            with self.action(action, in_fp, out_fp, size):
+            worker = self.make_chunk_worker(action, in_fp, out_fp)
+            with self.action(action, in_fp, out_fp, size, worker):
                 self._cipher_bootstrap(action,
                                        self.key, self.init_vector,
                                        in_fp, out_fp, size,
-                                       round_callback)
+                                       round_callback,
+                                       worker)
 
         thread = threading.Thread(target=_, args=file_state)
         thread.start()
@@ -359,7 +593,90 @@ class EncPanel(QDialog, object):
 
         fns = [item.toLocalFile() for item in event.mimeData().urls()]
 
-        self.emit_extend_buffer(fns)
+        self.extend_or_pack(fns)
+
+
+    def extend_or_pack(self, fns):
+        """With packing enabled, several paths or a directory become one
+        pack, packs among them are queued for extraction."""
+        if not self.options['pack_files']:
+            self.emit_extend_buffer(fns)
+            return
+
+        packs = [fn for fn in fns if fn.endswith(PACK_SUFFIX)]
+        fns = [fn for fn in fns if not fn.endswith(PACK_SUFFIX)]
+        if len(fns) > 1 or any(os.path.isdir(fn) for fn in fns):
+            self.start_pack(fns)
+        elif fns:
+            self.emit_extend_buffer(fns)
+
+        if not packs:
+            return
+        if self.busy or self.file_path_in.text():
+            # carry the action, plain buffer items inherit the action of
+            # the task before them
+            self.task_buffer.extend_buffer.emit(
+                [(self.ACT_DEC, fn, '') for fn in packs]
+            )
+        else:
+            self.task_buffer.extend_buffer.emit(
+                [(self.ACT_DEC, fn, '') for fn in packs[1:]]
+            )
+            self.start_new_task(self.ACT_DEC, packs[0])
+
+
+    def toggle_watching(self):
+        if self.watcher is not None:
+            self.stop_watching()
+            return
+
+        watch_dir = QFileDialog.getExistingDirectory(self,
+                                                     'Folder to watch',
+                                                     self.last_directory)
+        if not watch_dir:
+            return
+        mirror_dir = QFileDialog.getExistingDirectory(self,
+                                                      'Output folder',
+                                                      self.last_directory)
+        if not mirror_dir:
+            return
+
+        watch_dir = os.path.abspath(watch_dir)
+        mirror_dir = os.path.abspath(mirror_dir)
+        if not self.is_outside(os.path.relpath(mirror_dir, watch_dir)):
+            self.logger.error('output folder must not be inside '
+                              'the watched folder')
+            return
+
+        self.mirror_dir = mirror_dir
+        self.watcher = make_watcher(watch_dir,
+                                    self.watched_file_ready.emit,
+                                    self.logger)
+        self.watcher.start()
+
+        self.logger.info('encrypting new files into %s', mirror_dir)
+        self.watch_button.setText('Stop &Watch')
+
+
+    @Slot(int)
+    def stop_watching(self, result=None):
+        if self.watcher is None:
+            return
+
+        self.watcher.stop()
+        self.watcher = None
+        self.watch_button.setText('&Watch...')
+
+
+    @Slot(str)
+    def enqueue_watched_file(self, fn):
+        # decide the mirror path now, watching may have stopped or moved
+        # to another folder by the time the task starts
+        out_fn = self.output_path_for(fn)
+        if self.busy or self.file_path_in.text():
+            self.task_buffer.extend_buffer.emit([(self.ACT_ENC, fn, out_fn)])
+        else:
+            self.start_new_task(self.ACT_ENC, fn, out_fn)
 
 
     def emit_extend_buffer(self, fns):
@@ -406,6 +723,8 @@ class EncPanel(QDialog, object):
 
 
     def initialize_action(self):
+        self.busy = True
+
         self.enc_button.setEnabled(False)
         self.dec_button.setEnabled(False)
 
@@ -416,7 +735,7 @@ class EncPanel(QDialog, object):
 
 
     def start_enc(self):
-        fp = _, _, total = self.open_files()
+        fp = _, _, total = self.open_files(self.ACT_ENC)
 
         if None in fp:
             return
@@ -429,7 +748,11 @@ class EncPanel(QDialog, object):
 
 
     def start_dec(self):
-        fp = _, _, total = self.open_files()
+        if self.file_path_in.text().endswith(PACK_SUFFIX):
+            self.start_unpack()
+            return
+
+        fp = _, _, total = self.open_files(self.ACT_DEC)
 
         if None in fp:
             return
@@ -441,6 +764,142 @@ class EncPanel(QDialog, object):
                           self.gen_callback(total))
 
 
+    def start_pack(self, fns):
+        """Encrypt `fns`, directories included, as a single pack, now or
+        after the running tasks."""
+        if self.busy or self.file_path_in.text():
+            self.task_buffer.extend_buffer.emit([(self.ACT_ENC, fns, '')])
+        else:
+            self.run_pack(fns)
+
+
+    @Slot(list)
+    def run_pack(self, fns):
+        try:
+            entries = collect_entries(fns)
+        except (PackError, OSError) as e:
+            self.logger.error('cannot pack: %s', e)
+            self.skip_task(self.ACT_ENC)
+            return
+        if not entries:
+            self.logger.error('nothing to pack')
+            self.skip_task(self.ACT_ENC)
+            return
+
+        if len(fns) == 1:
+            in_fn = os.path.abspath(fns[0])
+            out_base = in_fn
+        else:
+            in_fn = os.path.dirname(os.path.abspath(fns[0]))
+            out_base = os.path.join(in_fn,
+                                    time.strftime('pack-%Y%m%d-%H%M%S'))
+
+        # open the output first, the reader takes its share of the budget
+        # as soon as it is created
+        try:
+            out_fp = self.create_new_file(out_base, PACK_SUFFIX)
+        except (IOError, OSError) as e:
+            self.logger.error('cannot create %s%s: %s', out_base, PACK_SUFFIX,
+                              e.strerror or e)
+            self.skip_task(self.ACT_ENC)
+            return
+
+        self.last_directory = os.path.dirname(out_fp.name)
+        self.echo_selected_file(in_fn, out_fp.name)
+        reader = PackReader(entries, MEMORY_BUDGET,
+                            2 * CHUNK_SIZE_AND_A_BLOCK)
+        self.logger.info('packing %d files, stream size %s (%s bytes)',
+                         len(entries),
+                         self.to_human_readable(reader.size), reader.size)
+
+        self.initialize_action()
+        self.idleness.setText('<font color=green><b>pack</b></font>')
+        self.start_action(maes.cbc_aes,
+                          (reader, out_fp, reader.size),
+                          self.gen_callback(reader.size))
+
+
+    @staticmethod
+    def create_new_file(base, suffix):
+        """Create and open `base` + `suffix` for writing, or `base`-N +
+        `suffix` with the lowest N which does not exist yet, so that no
+        earlier output is overwritten."""
+        fn = base + suffix
+        n = 0
+        while True:
+            try:
+                fd = os.open(fn, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                             0o666)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                n += 1
+                fn = '%s-%d%s' % (base, n, suffix)
+            else:
+                # the file is ours now, reopen it by name so that it is
+                # a regular file object with a useful `name`
+                os.close(fd)
+                return open(fn, 'wb')
+
+
+    def start_unpack(self):
+        """Extract the entries the user picks from the pack in the input
+        path, only their blocks are read and decrypted."""
+        in_fn = self.file_path_in.text()
+        out_dir = self.file_path_out.text()
+        if out_dir == self.output_path_for(in_fn):
+            # the default picked on selection, before the action was known
+            out_dir = self.output_path_for(in_fn, self.ACT_DEC)
+        if not out_dir:
+            self.logger.error('please specify output path')
+            self.skip_task(self.ACT_DEC)
+            return
+
+        try:
+            in_fp = open(in_fn, 'rb')
+        except IOError as e:
+            self.logger.error('cannot open %s: %s', in_fn, e.strerror or e)
+            self.skip_task(self.ACT_DEC)
+            return
+
+        try:
+            entries = read_index(in_fp, self.key, self.init_vector)
+        except (PackError, struct.error) as e:
+            in_fp.close()
+            self.logger.error('cannot read pack %s: %s', in_fn, e)
+            self.skip_task(self.ACT_DEC)
+            return
+
+        dialog = PackEntriesDialog(self, entries)
+        selected = dialog.get_selected()\
+                   if dialog.exec_() == QDialog.Accepted else []
+        if not selected:
+            in_fp.close()
+            self.logger.info('nothing to extract from %s', in_fn)
+            self.skip_task(self.ACT_DEC)
+            return
+
+        extractor = PackExtractor(out_dir, selected,
+                                  MEMORY_BUDGET, CHUNK_SIZE)
+        self.logger.info('extracting %d of %d entries, %s (%s bytes)',
+                         len(selected), len(entries),
+                         self.to_human_readable(extractor.size),
+                         extractor.size)
+
+        self.initialize_action()
+        self.idleness.setText('<font color=green><b>dec</b></font>')
+        round_callback = self.gen_callback(extractor.size)
+
+        def _():
+            with self.action(maes.inv_cbc_aes,
+                             in_fp, extractor, extractor.size):
+                extractor.extract(in_fp, self.key, self.init_vector,
+                                  round_callback)
+
+        thread = threading.Thread(target=_)
+        thread.start()
+
+
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)